@@ -1,19 +1,125 @@
+import asyncio
+import atexit
+import functools
+import hashlib
+import json
 import logging
-from typing import Dict, Any, Optional
-
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from logging.handlers import QueueHandler, QueueListener
+from types import MappingProxyType
+from typing import (Dict, Any, Awaitable, Callable, ClassVar, Final, FrozenSet, List, Mapping, NamedTuple, Optional,
+                    Set, Tuple)
+
+import numpy as np
+import orjson
 from google.adk.agents import Agent, State, Flow
 from google.adk.plugins import LoggingPlugin
 from google.adk.tools.google_search_tool import GoogleSearchTool
 from google.adk.tools import google_search
+from google import genai
 from google.genai import types
 
 # --- Configuration and Initialization Placeholders ---
 
 # 1. Setup Logging
 # The LoggingPlugin handles this.
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Records are handed to a background QueueListener as-is and rendered there as one
+# JSON object per line, so agents never format or write log output themselves.
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': record.created,
+            'lvl': record.levelname,
+            'logger': record.name,
+            'msg': record.msg,
+            'args': record.args,
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode('utf-8')
+
+
+class _DeferredQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats the message on the caller's thread; leave that to the listener.
+        return record
+
+
+def _configure_logging() -> Optional[QueueListener]:
+    root_logger = logging.getLogger()
+    if root_logger.handlers:
+        # The host (ADK runner, test runner, embedding app) already set up logging; like basicConfig, leave it alone.
+        return None
+
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(_JsonFormatter())
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(_DeferredQueueHandler(log_queue))
+
+    listener.start()
+    # Drains the queue so records logged right before exit are still written.
+    atexit.register(listener.stop)
+    return listener
+
+
+_log_listener = _configure_logging()
 logger = logging.getLogger('CareerBuilderHelper')
 
+# Upper bound on concurrent Google Search calls, per agent fan-out and in the search thread pool.
+MAX_CONCURRENT_SEARCHES = 8
+
+# CollegeResearchAgent races differently phrased searches and keeps the first usable
+# result; the attempt cap bounds the extra search cost.
+COLLEGE_QUERY_VARIANTS = ('Top', 'Best', 'Highest-ranked')
+COLLEGE_RESEARCH_ATTEMPTS = 2
+COLLEGE_RESEARCH_TIMEOUT = 15  # seconds
+MIN_COLLEGE_RESULTS = 3
+
+# Agent execution modes: 'realtime' calls the LLM inline, 'offline' queues the
+# request for a Gemini Batch Mode job (discounted, but minutes of latency).
+REALTIME = 'realtime'
+OFFLINE = 'offline'
+
+# Matches one entry of a numbered list such as "1. X, 2. Y, 3. Z." (or "1.X, 2.Y") and
+# captures its text without the trailing separator. Entries may contain commas
+# ("University of California, Berkeley"), so an entry only ends where the next "<n>."
+# begins; "<n>.<digit>" is a decimal ("GPA 3.5"), not a new entry.
+_NUMBERED_ITEM_RE = re.compile(r"(?:^|(?<=\s))\d+\.(?!\d)\s*(.+?)[,.]?\s*(?=\s\d+\.(?!\d)|$)")
+
+
+def parse_numbered_list(text: str) -> List[str]:
+    """Splits numbered search/LLM output ("1. X, 2. Y, 3. Z.") into its entries; [] if it is not numbered."""
+    return _NUMBERED_ITEM_RE.findall(text)
+
+
+# Embedding model used to match near-duplicate queries in the semantic query cache.
+EMBEDDING_MODEL = 'text-embedding-004'
+
+
+@functools.lru_cache(maxsize=1)
+def _genai_client() -> genai.Client:
+    """Shared google-genai client, created on first use."""
+    return genai.Client()
+
+
+def _embed_query(query: str) -> np.ndarray:
+    """Embeds a query and normalizes it, so cosine similarity is a plain dot product."""
+    response = _genai_client().models.embed_content(model=EMBEDDING_MODEL, contents=query)
+    embedding = np.asarray(response.embeddings[0].values, dtype=np.float32)
+    return embedding / np.linalg.norm(embedding)
+
 
 def setup_adk_environment():
     """Simulates initializing ADK plugins and tools."""
@@ -39,74 +145,564 @@ def setup_adk_environment():
     return {
         'logger': logger,
         'search_tool': 'GoogleSearchTool_Instance',
+        'search_func': mock_search,  # Set to _thread_local_search for live Google Search grounding
         'retry_config': 'HttpRetryOptions_Config',
-        'adk_plugins': 'LoggingPlugin_Instance'
+        'adk_plugins': 'LoggingPlugin_Instance',
+        'execution_modes': {'A6_Reviewer': REALTIME},  # Set to OFFLINE to run an agent through Gemini Batch Mode
+        'cache_enabled': False,  # Reuse results of semantically similar searches
+        'max_concurrency': 64  # Upper bound on agents the scheduler runs at the same time
     }
 
 
+# --- Search Batching ---
+
+# Model that answers searches with Google Search grounding.
+SEARCH_MODEL = 'gemini-2.5-flash'
+_GROUNDED_SEARCH_CONFIG = types.GenerateContentConfig(tools=[types.Tool(google_search=types.GoogleSearch())])
+
+# ADK's GoogleSearchTool is a built-in model tool with no blocking call of its own, so
+# worker threads search through a grounded generate_content call instead. Each thread
+# owns its genai client, and with it its HTTP connection pool, so concurrent searches
+# do not serialize on a pool shared by all threads.
+_thread_tools = threading.local()
+
+
+def _thread_local_search(query: str) -> str:
+    client = getattr(_thread_tools, 'client', None)
+    if client is None:
+        client = _thread_tools.client = genai.Client()
+    response = client.models.generate_content(model=SEARCH_MODEL, contents=query, config=_GROUNDED_SEARCH_CONFIG)
+    return response.text
+
+
+SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_SEARCHES, thread_name_prefix='search')
+
+
+class BatchingSearchTool:
+    """
+    Wraps the Google Search Tool so that queries issued together share one dispatch.
+    Modelled on the Google API client's BatchRequest: queue() collects a query with
+    the callback that receives its result, and execute_async() sends the whole batch.
+    Identical queries are searched once; results are kept in a dict keyed by query hash.
+    Searches run on the executor's worker threads, using each thread's own genai client.
+    """
+
+    def __init__(self, results: Optional[Dict[str, str]] = None, executor: Executor = SEARCH_EXECUTOR,
+                 search_func: Callable[[str], str] = _thread_local_search):
+        self.executor = executor
+        self.search_func = search_func
+        self.results = results if results is not None else {}
+        self._pending: List[Tuple[str, Callable[[Optional[str], Optional[Exception]], None]]] = []
+        self._flush_scheduled = False
+        self._flush_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def query_key(query: str) -> str:
+        """Key under which the result of a query is stored."""
+        return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+    def queue(self, query: str, callback: Callable[[Optional[str], Optional[Exception]], None]):
+        """Adds a query to the batch; callback(result, error) is invoked once the batch is executed."""
+        self._pending.append((query, callback))
+
+    async def execute_async(self):
+        """Dispatches every queued query; each query's callbacks run as soon as its result arrives."""
+        batch, self._pending = self._pending, []
+        queries: Dict[str, str] = {}
+        callbacks: Dict[str, List[Callable[[Optional[str], Optional[Exception]], None]]] = {}
+        for query, callback in batch:
+            key = self.query_key(query)
+            queries[key] = query
+            callbacks.setdefault(key, []).append(callback)
+
+        # The executor's worker count bounds how many searches are in flight.
+        loop = asyncio.get_running_loop()
+
+        async def resolve(key: str, query: str):
+            result, error = self.results.get(key), None
+            if key not in self.results:
+                try:
+                    result = self.results[key] = await loop.run_in_executor(
+                        self.executor, self.search_func, query
+                    )
+                except Exception as e:
+                    error = e
+            for callback in callbacks[key]:
+                callback(result, error)
+
+        await asyncio.gather(*(resolve(key, query) for key, query in queries.items()))
+
+    async def search(self, query: str) -> str:
+        """
+        Queues a single query and waits for its result. All queries queued during the
+        same event loop iteration (e.g. a per-college fan-out) go out in one batch.
+        """
+        result = asyncio.get_running_loop().create_future()
+
+        def resolve(value: Optional[str], error: Optional[Exception]):
+            if result.done():
+                # The caller stopped waiting (e.g. a losing first-success attempt was cancelled).
+                return
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(value)
+
+        self.queue(query, resolve)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+        return await result
+
+    def _flush(self):
+        self._flush_scheduled = False
+        self._flush_task = asyncio.ensure_future(self.execute_async())
+
+
+# --- Gemini Batch Mode ---
+
+class GeminiBatchJob:
+    """
+    Collects the LLM requests of agents running in offline execution mode and
+    submits them as a single Gemini Batch Mode job. Queued requests are held in
+    memory; each job writes its own JSONL input file, so requests queued while a
+    job is in flight go out with the next one. Every request gets a future that
+    the job carrying it resolves, or fails when that job or the request failed.
+    """
+
+    DONE_STATES = ('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED', 'JOB_STATE_CANCELLED', 'JOB_STATE_EXPIRED')
+
+    def __init__(self, model: str = 'gemini-2.5-flash', poll_interval: float = 30.0):
+        self.model = model
+        self.poll_interval = poll_interval
+        self._requests: List[Dict[str, Any]] = []
+        # key -> (callback receiving the response text, future answered by the job)
+        self._pending: Dict[str, Tuple[Callable[[str], None], asyncio.Future]] = {}
+        self._flush_lock = asyncio.Lock()
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    async def flush(self):
+        """
+        Makes sure every request queued so far has been answered: runs a job for any
+        pending requests, or waits for the job that is already carrying them.
+        """
+        async with self._flush_lock:
+            if self.has_pending:
+                await self.run()
+
+    def queue(self, key: str, prompt: str, callback: Callable[[str], None]) -> asyncio.Future:
+        """
+        Adds a request to the next job; callback(text) receives the model response. The returned
+        future resolves to the text once the callback has run, or fails if the request did.
+        """
+        if key in self._pending:
+            raise ValueError(f"Batch request already queued: {key}")
+        self._requests.append({'key': key, 'request': {'contents': [{'parts': [{'text': prompt}], 'role': 'user'}]}})
+        answered = asyncio.get_running_loop().create_future()
+        self._pending[key] = (callback, answered)
+        return answered
+
+    async def run(self):
+        """
+        Submits the queued requests, waits for the job to finish and dispatches the responses.
+        A failed request only fails its own future; all failures of the job are logged together.
+        """
+        requests, self._requests = self._requests, []
+        pending, self._pending = self._pending, {}
+
+        try:
+            responses = await self._run_job(requests)
+        except asyncio.CancelledError:
+            for _, answered in pending.values():
+                answered.cancel()
+            raise
+        except Exception as e:
+            logger.error("Gemini batch job for %d request(s) failed: %s", len(pending), e)
+            for _, answered in pending.values():
+                answered.set_exception(e)
+            return
+
+        failures: Dict[str, Exception] = {}
+        for key, (callback, answered) in pending.items():
+            response = responses.get(key)
+            try:
+                if response is None:
+                    raise RuntimeError(f"Gemini batch job returned no response for {key}")
+                if 'error' in response:
+                    raise RuntimeError(f"Batch request {key} failed: {response['error']}")
+                text = response['response']['candidates'][0]['content']['parts'][0]['text']
+                callback(text)
+            except Exception as e:
+                failures[key] = e
+                answered.set_exception(e)
+            else:
+                answered.set_result(text)
+
+        if failures:
+            logger.error("%d of %d batch request(s) failed: %s", len(failures), len(pending), failures)
+
+    async def _run_job(self, requests: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Runs one Batch Mode job over the requests and returns its response lines by request key."""
+        client = _genai_client()
+
+        # The input file belongs to this job alone and is removed once uploaded.
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as batch_file:
+            for request in requests:
+                batch_file.write(json.dumps(request) + '\n')
+        try:
+            uploaded_file = await asyncio.to_thread(
+                client.files.upload,
+                file=batch_file.name,
+                config=types.UploadFileConfig(display_name='career-builder-batch', mime_type='jsonl'),
+            )
+        finally:
+            os.remove(batch_file.name)
+
+        job = await asyncio.to_thread(
+            client.batches.create,
+            model=self.model,
+            src=uploaded_file.name,
+            config={'display_name': 'career-builder-batch'},
+        )
+        logger.info("Submitted Gemini batch job %s with %d request(s).", job.name, len(requests))
+
+        while job.state.name not in self.DONE_STATES:
+            await asyncio.sleep(self.poll_interval)
+            job = await asyncio.to_thread(client.batches.get, name=job.name)
+
+        if job.state.name != 'JOB_STATE_SUCCEEDED':
+            raise RuntimeError(f"Gemini batch job {job.name} ended in state {job.state.name}: {job.error}")
+
+        results = await asyncio.to_thread(client.files.download, file=job.dest.file_name)
+        responses = {}
+        for line in results.decode('utf-8').splitlines():
+            if line.strip():
+                response = json.loads(line)
+                responses[response['key']] = response
+        return responses
+
+
+# --- Semantic Query Cache ---
+
+class SemanticQueryCache:
+    """
+    LRU cache of tool results keyed by query embedding. A lookup hits when a cached
+    query is similar enough to the new one, so near-duplicate searches are served
+    without another round trip. Entries expire after ttl_seconds.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0, similarity_threshold: float = 0.92):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # query -> (normalized embedding, result, insertion time)
+        self.entries: OrderedDict[str, Tuple[np.ndarray, str, float]] = OrderedDict()
+
+    def lookup(self, embedding: np.ndarray) -> Optional[str]:
+        """Returns the result of the most similar cached query, if it clears the threshold."""
+        self._evict_expired()
+        if not self.entries:
+            return None
+
+        queries = list(self.entries)
+        similarities = np.stack([entry[0] for entry in self.entries.values()]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        self.entries.move_to_end(queries[best])
+        return self.entries[queries[best]][1]
+
+    def insert(self, query: str, embedding: np.ndarray, result: str):
+        self.entries[query] = (embedding, result, time.monotonic())
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def _evict_expired(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        expired = [query for query, (_, _, inserted_at) in self.entries.items() if inserted_at < cutoff]
+        for query in expired:
+            del self.entries[query]
+
+
 # --- Shared State Management (Memory) ---
 
+@dataclass(slots=True)
 class CareerState:
     """
     Central state object, acting as the memory shared between all agents.
     In the ADK, this would typically be managed by the Memory component.
     """
 
-    def __init__(self):
-        self.interest_area: Optional[str] = None
-        self.suggested_streams: Optional[str] = None  # Stream 2 result
-        self.user_location: Optional[Dict[str, str]] = None  # State and City
-        self.target_stream: Optional[str] = None  # The stream user selects
-        self.college_results: Optional[str] = None  # Stream 4 result
-        self.criteria_details: Optional[str] = None  # Stream 5 result
-        self.reviewer_notes: Optional[str] = None  # Stream 6 result
-        self.final_summary: Optional[str] = None  # Stream 7 result
+    interest_area: Optional[str] = None
+    suggested_streams: Optional[str] = None  # Stream 2 result
+    user_location: Optional[Dict[str, str]] = None  # State and City
+    target_stream: Optional[str] = None  # The stream user selects
+    college_results: Optional[str] = None  # Stream 4 result
+    criteria_details: Optional[str] = None  # Stream 5 result
+    reviewer_notes: Optional[str] = None  # Stream 6 result
+    final_summary: Optional[str] = None  # Stream 7 result
+    # Search results keyed by query hash
+    search_results: Dict[str, str] = field(default_factory=dict, init=False, repr=False)
+    # Used when env['cache_enabled'] is set. It belongs to this state object and is not
+    # stored in memory snapshots, so it only serves repeated queries within a single run.
+    query_cache: SemanticQueryCache = field(default_factory=SemanticQueryCache, init=False, repr=False,
+                                            compare=False)
+    # Keeps the multi-field writes (set_selection, update_state) atomic. Single-field setters
+    # do not take it; agents all run on the event loop thread, so the state is not thread-safe.
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+
+    # Names of the state fields agents may write, in the order the stages write them;
+    # filled in right after the class is built.
+    _STAGE_KEYS: ClassVar[Tuple[str, ...]]
+    _VALID_KEYS: ClassVar[FrozenSet[str]]
+
+    def set_interest(self, interest_area: str):
+        if interest_area != self.interest_area:
+            # Cached results were scoped to the previous interest area.
+            self.query_cache.clear()
+            self._reset_after('interest_area')
+        self.interest_area = interest_area
+        logger.info("state_updated %s", {"interest_area": interest_area})
+
+    def set_streams(self, suggested_streams: str):
+        if suggested_streams != self.suggested_streams:
+            self._reset_after('suggested_streams')
+        self.suggested_streams = suggested_streams
+        logger.info("state_updated %s", {"suggested_streams": suggested_streams})
+
+    def set_selection(self, user_location: Dict[str, str], target_stream: str):
+        with self._lock:
+            if user_location != self.user_location or target_stream != self.target_stream:
+                self._reset_after('target_stream')
+            self.user_location = user_location
+            self.target_stream = target_stream
+        logger.info("state_updated %s", {"user_location": user_location, "target_stream": target_stream})
+
+    def set_colleges(self, college_results: str):
+        if college_results != self.college_results:
+            self._reset_after('college_results')
+        self.college_results = college_results
+        logger.info("state_updated %s", {"college_results": college_results})
+
+    def set_criteria(self, criteria_details: str):
+        if criteria_details != self.criteria_details:
+            self._reset_after('criteria_details')
+        self.criteria_details = criteria_details
+        logger.info("state_updated %s", {"criteria_details": criteria_details})
+
+    def set_review(self, reviewer_notes: str):
+        if reviewer_notes != self.reviewer_notes:
+            self._reset_after('reviewer_notes')
+        self.reviewer_notes = reviewer_notes
+        logger.info("state_updated %s", {"reviewer_notes": reviewer_notes})
+
+    def set_summary(self, final_summary: str):
+        self.final_summary = final_summary
+        logger.info("state_updated %s", {"final_summary": final_summary})
+
+    def _reset_after(self, key: str):
+        """Clears the results of every stage after the one that writes key; they were built from its old value."""
+        for later_key in self._STAGE_KEYS[self._STAGE_KEYS.index(key) + 1:]:
+            setattr(self, later_key, None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the agent-written state fields as a plain dict (slotted instances have no __dict__)."""
+        return {key: getattr(self, key) for key in self._VALID_KEYS}
 
     def update_state(self, **kwargs):
-        """Helper to update state dynamically."""
-        for key, value in kwargs.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
-            else:
-                logger.warning(f"Attempted to set unknown state key: {key}")
-        logger.info(f"State updated: {kwargs}")
+        """Helper to update state dynamically; prefer the typed setters above."""
+        if 'interest_area' in kwargs:
+            self.set_interest(kwargs.pop('interest_area'))
+            if not kwargs:
+                return
+        with self._lock:
+            for key, value in kwargs.items():
+                if key in self._VALID_KEYS:
+                    setattr(self, key, value)
+                else:
+                    logger.warning("Attempted to set unknown state key: %s", key)
+        logger.info("state_updated %s", kwargs)
+
+
+CareerState._STAGE_KEYS = tuple(f.name for f in fields(CareerState) if f.init)
+CareerState._VALID_KEYS = frozenset(CareerState._STAGE_KEYS)
+
+
+# --- Session Memory ---
+
+class CareerStateMemory:
+    """
+    Keeps a snapshot of each session's CareerState, with a store/load API in the
+    style of the ADK's InMemoryMemoryService. The flow stores the state after
+    every completed agent, so a re-run of the session resumes after the last
+    completed stage instead of repeating its searches and LLM calls.
+    Snapshots live in process memory: re-runs within one process (e.g. a retried
+    session in a long-running server) resume, while a new `python agent.py` starts over.
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, str] = {}
+
+    def store(self, session_id: str, state: CareerState):
+        self._snapshots[session_id] = json.dumps(state.to_dict())
+
+    def load(self, session_id: str) -> Optional[CareerState]:
+        snapshot = self._snapshots.get(session_id)
+        return CareerState(**json.loads(snapshot)) if snapshot is not None else None
+
+
+STATE_MEMORY = CareerStateMemory()
+
+
+# --- Mock Data ---
+# Canned user input and tool output standing in for real prompts, searches and LLM calls.
+
+MOCK_INTEREST: Final[str] = "Biotechnology and sustainable energy"
+
+MOCK_STREAMS: Final[str] = (
+    "1. Applied Biological Sciences (Focus on Bio-engineering), "
+    "2. Environmental Science and Policy, "
+    "3. Chemical Engineering with a focus on Renewable Fuels."
+)
+
+MOCK_LOCATION: Final[Mapping[str, str]] = MappingProxyType({"state": "California", "city": "Berkeley"})
+MOCK_SELECTION: Final[str] = "Applied Biological Sciences (Focus on Bio-engineering)"
+
+MOCK_COLLEGES: Final[str] = (
+    "1. University of California, Berkeley (Bioengineering), "
+    "2. Stanford University (Sustainable Science and Tech), "
+    "3. UC Davis (Applied Biology)."
+)
+
+MOCK_CRITERIA: Final[Mapping[str, str]] = MappingProxyType({
+    "University of California, Berkeley (Bioengineering)":
+        "UC Berkeley: GPA 4.0+, SAT/ACT Optional, essays focused on innovation.",
+    "Stanford University (Sustainable Science and Tech)":
+        "Stanford: Extremely selective, requires two recommendation letters, unique project portfolio.",
+    "UC Davis (Applied Biology)":
+        "UC Davis: Minimum GPA 3.5, emphasis on high school science courses.",
+})
+
+_MOCK_CRITERIA_QUERY_PREFIX: Final[str] = "Admission criteria and process for "
+
+
+def mock_search(query: str) -> str:
+    """Stands in for a Google Search call, answering the agents' queries with the canned results above."""
+    if query.startswith(_MOCK_CRITERIA_QUERY_PREFIX):
+        college = query[len(_MOCK_CRITERIA_QUERY_PREFIX):]
+        return MOCK_CRITERIA.get(college, f"{college}: No admission criteria found.")
+    if " colleges in " in query:
+        return MOCK_COLLEGES
+    if " streams " in query:
+        return MOCK_STREAMS
+    return ""
+
+
+MOCK_REVIEW_NOTES: Final[str] = (
+    "All data appears consistent. The suggested streams align with 'Biotechnology and sustainable energy'. "
+    "College names are accurately matched to the location and target stream. "
+    "The criteria are specific and look accurate based on general knowledge of these institutions."
+)
 
 
 # --- Agent Definitions ---
 
+@functools.lru_cache(maxsize=128)
+def _get_agent_logger(name: str) -> logging.Logger:
+    """Per-agent logger, cached so re-created agents skip building the logger name."""
+    return logging.getLogger(f'ADK.{name}')
+
+
 # Mock Base Agent to simulate the ADK structure
 class MockAgent:
-    def __init__(self, name: str, state: CareerState, tools: Dict[str, Any]):
+    # State fields the agent writes; used to skip agents whose results were restored from memory.
+    output_keys: Tuple[str, ...] = ()
+    # Agents that capture user input run again on every re-run, so a resumed session picks
+    # up changed answers; a changed answer clears the results of the stages built on it.
+    asks_user: bool = False
+
+    def __init__(self, name: str, state: CareerState, tools: Dict[str, Any], execution_mode: str = REALTIME,
+                 session_id: str = 'default'):
+        if execution_mode not in (REALTIME, OFFLINE):
+            raise ValueError(f"Unknown execution mode for {name}: {execution_mode}")
         self.name = name
+        self.session_id = session_id
         self.state = state
         self.tools = tools
-        self.logger = logging.getLogger(f'ADK.{name}')
+        self.execution_mode = execution_mode
+        self.logger = _get_agent_logger(name)
+        # Futures of the requests this agent queued on the Gemini batch job, answered when its job finishes.
+        self.batch_requests: List[asyncio.Future] = []
 
-    def execute(self) -> str:
-        """The main logic for the agent to implement."""
+    async def execute(self) -> str:
+        """The main logic for the agent to implement, run as a coroutine on the flow's event loop."""
         raise NotImplementedError("Subclasses must implement the execute method.")
 
+    def is_complete(self) -> bool:
+        """True when every state field this agent produces is already filled in."""
+        if self.asks_user:
+            return False
+        return bool(self.output_keys) and all(getattr(self.state, key) is not None for key in self.output_keys)
+
+    def queue_offline(self, prompt: str, callback: Callable[[str], None]):
+        """Queues an LLM request on the Gemini batch job under this session and agent."""
+        key = f"{self.session_id}/{self.name}"
+        self.batch_requests.append(self.tools['gemini_batch'].queue(key, prompt, callback))
+
+    async def run_blocking(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs a blocking tool call in a worker thread so other agents keep running meanwhile."""
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def cached_search(self, query: str, match_similar: bool = True) -> str:
+        """
+        Searches through the shared batch, reusing the result of a similar earlier query when caching is on.
+        Pass match_similar=False for per-entity queries built from one template ("... for <college>"):
+        those differ only in the entity and would match each other, so they are only reused verbatim.
+        """
+        if not self.tools['cache_enabled'] or not match_similar:
+            # The batch still reuses the stored result of an identical query.
+            return await self.tools['search_batch'].search(query)
+
+        embedding = await self.run_blocking(_embed_query, query)
+        cached_result = self.state.query_cache.lookup(embedding)
+        if cached_result is not None:
+            self.logger.info("Semantic cache hit for query: %s", query)
+            return cached_result
+
+        result = await self.tools['search_batch'].search(query)
+        self.state.query_cache.insert(query, embedding, result)
+        return result
+
 
 class InterestAgent(MockAgent):
     """1. Ask the user what is current interest area."""
 
-    def execute(self) -> str:
+    output_keys = ('interest_area',)
+    asks_user = True
+
+    async def execute(self) -> str:
         #  Involve prompting the user
         # through a Context object and waiting for input.
 
-        # --- Mock User Input ---
-        mock_interest = "Biotechnology and sustainable energy"
-        # --- End Mock User Input ---
-
-        self.state.update_state(interest_area=mock_interest)
-        self.logger.info(f"Captured user interest: {mock_interest}")
+        self.state.set_interest(MOCK_INTEREST)  # Mock User Input
+        self.logger.info("Captured user interest: %s", MOCK_INTEREST)
         return "NEXT_STATE"
 
 
 class StreamResearchAgent(MockAgent):
     """2. Get the input of user interest and research 3 best streams."""
 
-    def execute(self) -> str:
+    output_keys = ('suggested_streams',)
+
+    async def execute(self) -> str:
         interest = self.state.interest_area
         if not interest:
             self.logger.error("Interest area missing. Cannot research streams.")
@@ -115,75 +711,96 @@ class StreamResearchAgent(MockAgent):
         # ADK Action: Use Google Search Tool
         search_query = f"3 best high school and college educational streams for interest in {interest}"
 
-        # In a real ADK Agent, you would call:
-        # search_results = self.tools['google_search'].run(query=search_query)
-
-        # --- Mock Search Result ---
-        mock_streams = (
-            "1. Applied Biological Sciences (Focus on Bio-engineering), "
-            "2. Environmental Science and Policy, "
-            "3. Chemical Engineering with a focus on Renewable Fuels."
-        )
-        # --- End Mock Search Result ---
+        suggested_streams = await self.cached_search(search_query)
+        if not suggested_streams:
+            self.logger.error("Stream search returned no results.")
+            return "ERROR_STATE"
 
-        self.state.update_state(suggested_streams=mock_streams)
-        self.logger.info(f"Suggested streams: {mock_streams}")
+        self.state.set_streams(suggested_streams)
+        self.logger.info("Suggested streams: %s", suggested_streams)
         return "AWAIT_SELECTION"  # Transition to wait for user selection/location
 
 
 class LocationAgent(MockAgent):
     """3. Ask the user which State and City he wants to continue his study."""
 
-    def execute(self) -> str:
-        self.logger.info(f"Suggested Streams: {self.state.suggested_streams}")
+    output_keys = ('user_location', 'target_stream')
+    asks_user = True
 
-        # ADK Action: Prompt user for selection and location
+    async def execute(self) -> str:
+        self.logger.info("Suggested Streams: %s", self.state.suggested_streams)
 
-        # --- Mock User Input ---
-        mock_location = {"state": "California", "city": "Berkeley"}
-        mock_selection = "Applied Biological Sciences (Focus on Bio-engineering)"
-        # --- End Mock User Input ---
+        # ADK Action: Prompt user for selection and location
 
-        self.state.update_state(user_location=mock_location, target_stream=mock_selection)
-        self.logger.info(f"User selected: {mock_selection} in {mock_location['city']}, {mock_location['state']}")
+        # Mock User Input; the state gets its own copy of the read-only location mapping.
+        self.state.set_selection(dict(MOCK_LOCATION), MOCK_SELECTION)
+        self.logger.info("User selected: %s in %s, %s", MOCK_SELECTION, MOCK_LOCATION['city'], MOCK_LOCATION['state'])
         return "NEXT_STATE"
 
 
 class CollegeResearchAgent(MockAgent):
     """4. Use Google Search and perform the research for finding best 3 colleges."""
 
-    def execute(self) -> str:
+    output_keys = ('college_results',)
+
+    async def execute(self) -> str:
         stream = self.state.target_stream
         location = self.state.user_location
         if not stream or not location:
             self.logger.error("Stream or Location missing. Cannot research colleges.")
             return "ERROR_STATE"
 
-        search_query = (
-            f"Top 3 colleges in {location['city']}, {location['state']} "
-            f"for {stream} program"
-        )
+        search_queries = [
+            f"{variant} 3 colleges in {location['city']}, {location['state']} for {stream} program"
+            for variant in COLLEGE_QUERY_VARIANTS[:COLLEGE_RESEARCH_ATTEMPTS]
+        ]
 
-        # ADK Action: Use Google Search Tool
-        # search_results = self.tools['search_tool'].run(query=search_query)
-
-        # --- Mock Search Result ---
-        mock_colleges = (
-            "1. University of California, Berkeley (Bioengineering), "
-            "2. Stanford University (Sustainable Science and Tech), "
-            "3. UC Davis (Applied Biology)."
-        )
-        # --- End Mock Search Result ---
+        colleges = await self._first_success(search_queries)
+        if colleges is None:
+            self.logger.error("No college search returned a usable result.")
+            return "ERROR_STATE"
 
-        self.state.update_state(college_results=mock_colleges)
-        self.logger.info(f"Found colleges: {mock_colleges}")
+        self.state.set_colleges(colleges)
+        self.logger.info("Found colleges: %s", colleges)
         return "NEXT_STATE"
 
+    async def _first_success(self, search_queries: List[str]) -> Optional[str]:
+        """Runs the searches concurrently and returns the first result that lists enough colleges."""
+        tasks = [asyncio.create_task(self._search_colleges(query)) for query in search_queries]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + COLLEGE_RESEARCH_TIMEOUT
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self.logger.warning("College search timed out after %ss.", COLLEGE_RESEARCH_TIMEOUT)
+                    return None
+                for task in done:
+                    if task.exception() is not None:
+                        self.logger.warning("College search failed: %s", task.exception())
+                    elif len(parse_numbered_list(task.result())) >= MIN_COLLEGE_RESULTS:
+                        return task.result()
+                    else:
+                        self.logger.warning("College search returned too few colleges: %s", task.result())
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _search_colleges(self, search_query: str) -> str:
+        # ADK Action: Use Google Search Tool
+        return await self.cached_search(search_query)
+
 
 class CriteriaAgent(MockAgent):
     """5. Find the criteria of each college for admission and process."""
 
-    def execute(self) -> str:
+    output_keys = ('criteria_details',)
+
+    async def execute(self) -> str:
         colleges = self.state.college_results
         stream = self.state.target_stream
 
@@ -191,136 +808,371 @@ class CriteriaAgent(MockAgent):
             self.logger.error("College results missing. Cannot find criteria.")
             return "ERROR_STATE"
 
-        # ADK Action: Use Google Search Tool for detailed criteria
-        # This would typically be a loop, running a search for each college.
-        search_query_1 = f"Admission criteria and process for UC Berkeley Bioengineering"
-        search_query_2 = f"Admission criteria and process for Stanford Sustainable Science"
-
-        # --- Mock Search Result ---
-        mock_criteria = (
-            "UC Berkeley: GPA 4.0+, SAT/ACT Optional, essays focused on innovation. "
-            "Stanford: Extremely selective, requires two recommendation letters, unique project portfolio. "
-            "UC Davis: Minimum GPA 3.5, emphasis on high school science courses."
-        )
-        # --- End Mock Search Result ---
+        # Unnumbered results ("UC Berkeley and Stanford") are looked up as a single query.
+        college_names = parse_numbered_list(colleges) or [colleges.strip()]
 
-        self.state.update_state(criteria_details=mock_criteria)
+        # The per-college lookups are independent of each other, so they run
+        # concurrently and the stage takes as long as the slowest search.
+        # The semaphore caps in-flight searches so retries under HttpRetryOptions
+        # are not triggered by our own burst of requests.
+        search_slots = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+        tasks = [asyncio.create_task(self._search_one(name, search_slots)) for name in college_names]
+        criteria = await asyncio.gather(*tasks)
+
+        self.state.set_criteria(" ".join(criteria))
         self.logger.info("Admission criteria details gathered.")
         return "NEXT_STATE"
 
+    async def _search_one(self, college: str, search_slots: asyncio.Semaphore) -> str:
+        """Runs the admission criteria search for a single college."""
+        # ADK Action: Use Google Search Tool for detailed criteria
+        search_query = f"Admission criteria and process for {college}"
+
+        async with search_slots:
+            # The queries of the whole fan-out share one batch dispatch.
+            return await self.cached_search(search_query, match_similar=False)
+
+
+class ReviewInput(NamedTuple):
+    """The research results the reviewer cross-checks."""
+
+    interest: Optional[str]
+    streams: Optional[str]
+    location: Optional[Dict[str, str]]
+    colleges: Optional[str]
+    criteria: Optional[str]
+
+
+_REVIEW_PROMPT_TEMPLATE = "Analyze and validate this data: {data}. Identify any inconsistencies."
+
 
 class ReviewerAgent(MockAgent):
     """6. Create an Agent as Reviewer for analysis all research results and review thoroughly."""
 
-    def execute(self) -> str:
+    output_keys = ('reviewer_notes',)
+
+    async def execute(self) -> str:
         # Retrieve all collected data from state
-        data_to_review = {
-            'interest': self.state.interest_area,
-            'streams': self.state.suggested_streams,
-            'location': self.state.user_location,
-            'colleges': self.state.college_results,
-            'criteria': self.state.criteria_details
-        }
+        payload = ReviewInput(
+            self.state.interest_area,
+            self.state.suggested_streams,
+            self.state.user_location,
+            self.state.college_results,
+            self.state.criteria_details,
+        )
 
         # ADK Action: Use a specialized ADK model call (or even another LLM tool)
         # to cross-reference and validate the search results for correctness and relevance.
 
+        review_prompt = _REVIEW_PROMPT_TEMPLATE.format(data=orjson.dumps(payload._asdict()).decode('utf-8'))
+
+        if self.execution_mode == OFFLINE:
+            # The review does not need real-time latency, so it is deferred to the Gemini batch job.
+            self.queue_offline(review_prompt, self.state.set_review)
+            self.logger.info("Review request queued for Gemini Batch Mode.")
+            return "NEXT_STATE"
+
         # In the ADK, you would use a 'Generator' tool or an LLM call:
-        # review_prompt = f"Analyze and validate this data: {data_to_review}. Identify any inconsistencies."
-        # review_notes = self.tools['llm_tool'].generate(prompt=review_prompt)
-
-        # --- Mock Reviewer Output ---
-        mock_review_notes = (
-            "All data appears consistent. The suggested streams align with 'Biotechnology and sustainable energy'. "
-            "College names are accurately matched to the location and target stream. "
-            "The criteria are specific and look accurate based on general knowledge of these institutions."
-        )
-        # --- End Mock Reviewer Output ---
+        # review_notes = await self.run_blocking(self.tools['llm_tool'].generate, prompt=review_prompt)
 
-        self.state.update_state(reviewer_notes=mock_review_notes)
+        self.state.set_review(MOCK_REVIEW_NOTES)  # Mock Reviewer Output
         self.logger.info("Reviewer Agent completed analysis.")
         return "NEXT_STATE"
 
 
-class SummaryAgent(MockAgent):
-    """7. Make the summary of all three stream and respective colleges and criteria."""
-
-    def execute(self) -> str:
-        # Compile all parts into a final, polished summary
-        final_summary = f"""
+# Built once at import; SummaryAgent fills it from the state with str.format_map.
+_SUMMARY_TEMPLATE = """
         --- Career Builder Helper Summary ---
 
-        **User Interest:** {self.state.interest_area}
+        **User Interest:** {interest_area}
 
-        **Selected Stream:** {self.state.target_stream} (from the initial suggestions: {self.state.suggested_streams})
+        **Selected Stream:** {target_stream} (from the initial suggestions: {suggested_streams})
 
-        **Target Location:** {self.state.user_location['city']}, {self.state.user_location['state']}
+        **Target Location:** {user_location[city]}, {user_location[state]}
 
-        **Top 3 College Options for {self.state.target_stream}:**
-        {self.state.college_results}
+        **Top 3 College Options for {target_stream}:**
+        {college_results}
 
         **Admission Criteria & Process Overview:**
-        {self.state.criteria_details}
+        {criteria_details}
 
         **Reviewer Note (Validation):**
-        {self.state.reviewer_notes}
+        {reviewer_notes}
 
         This detailed plan provides a robust starting point for your education journey.
         """
-        self.state.update_state(final_summary=final_summary)
+
+
+class SummaryAgent(MockAgent):
+    """7. Make the summary of all three stream and respective colleges and criteria."""
+
+    output_keys = ('final_summary',)
+
+    async def execute(self) -> str:
+        # Compile all parts into a final, polished summary
+        final_summary = _SUMMARY_TEMPLATE.format_map(self.state.to_dict())
+        self.state.set_summary(final_summary)
         self.logger.info("Final summary generated.")
         return "FLOW_COMPLETE"
 
 
 # --- Main Flow Execution ---
 
-def run_career_builder_helper():
-    """Defines and executes the sequential agent flow."""
+# The agent flow: (agent name, agent class, names of the agents it depends on), in dependency order.
+AGENT_SPECS: List[Tuple[str, type, List[str]]] = [
+    ("A1_InterestCapture", InterestAgent, []),  # 1
+    ("A2_StreamResearch", StreamResearchAgent, ["A1_InterestCapture"]),  # 2
+    ("A3_LocationCapture", LocationAgent, ["A2_StreamResearch"]),  # 3
+    ("A4_CollegeSearch", CollegeResearchAgent, ["A3_LocationCapture"]),  # 4
+    ("A5_CriteriaSearch", CriteriaAgent, ["A4_CollegeSearch"]),  # 5
+    ("A6_Reviewer", ReviewerAgent, ["A5_CriteriaSearch"]),  # 6
+    ("A7_Summary", SummaryAgent, ["A6_Reviewer"]),  # 7
+]
+
+# Capacity of the queues between pipeline stages; a full queue pauses the stage feeding it.
+PIPELINE_QUEUE_SIZE = 4
+
+
+def _build_agent(name: str, agent_cls: type, state: CareerState, env: Dict[str, Any], session_id: str) -> MockAgent:
+    return agent_cls(name, state, env, env['execution_modes'].get(name, REALTIME), session_id)
+
+
+@dataclass
+class DAGNode:
+    """An agent scheduled by AgentDAG, described like a batch operation."""
+
+    id: str
+    agent: MockAgent
+    dependencies: List[str]
+    priority: int = 0  # Among agents that become ready together, higher priority is dispatched first
+    timeout: Optional[float] = None  # Seconds; None waits indefinitely
+
+
+class AgentDAG:
+    """
+    Dependency-graph scheduler for agents. It tracks the in-degree of every node and,
+    whenever an agent completes, immediately dispatches each dependent whose in-degree
+    drops to zero, with at most max_concurrency agents running at a time. A failing
+    agent stops further dispatches; agents already running are allowed to finish.
+    An agent whose results are already in the state when it is dispatched is skipped.
+    """
+
+    def __init__(self, max_concurrency: int = 64):
+        self.max_concurrency = max_concurrency
+        self.nodes: Dict[str, DAGNode] = {}
+
+    def add_node(self, agent: MockAgent, dependencies: List[str], priority: int = 0,
+                 timeout: Optional[float] = None):
+        if agent.name in self.nodes:
+            raise ValueError(f"Duplicate agent in graph: {agent.name}")
+        self.nodes[agent.name] = DAGNode(agent.name, agent, list(dependencies), priority, timeout)
+
+    async def run(self, on_success: Optional[Callable[[MockAgent], Awaitable[None]]] = None) -> bool:
+        """
+        Runs the graph; on_success is awaited after each agent that completes without error,
+        before its dependents are released. Returns True when every agent completed.
+        """
+        in_degree = {node_id: len(node.dependencies) for node_id, node in self.nodes.items()}
+        dependents: Dict[str, List[str]] = {node_id: [] for node_id in self.nodes}
+        for node in self.nodes.values():
+            for dependency in node.dependencies:
+                if dependency not in self.nodes:
+                    raise ValueError(f"{node.id} depends on unknown agent: {dependency}")
+                dependents[dependency].append(node.id)
+        self._check_acyclic(in_degree, dependents)
+
+        concurrency_slots = asyncio.Semaphore(self.max_concurrency)
+        running: Set[asyncio.Task] = set()
+
+        def dispatch(node_ids: List[str]):
+            for node_id in sorted(node_ids, key=lambda node_id: -self.nodes[node_id].priority):
+                node = self.nodes[node_id]
+                running.add(asyncio.create_task(self._run_node(node, concurrency_slots, on_success), name=node_id))
+
+        dispatch([node_id for node_id, degree in in_degree.items() if degree == 0])
+
+        completed = 0
+        failed = False
+        while running:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.result()]
+            completed += len(succeeded)
+            # Check the whole batch first, so a failure stops dispatches regardless of completion order.
+            failed = failed or len(succeeded) < len(done)
+            if failed:
+                continue
+            for task in succeeded:
+                ready = []
+                for dependent in dependents[task.get_name()]:
+                    in_degree[dependent] -= 1
+                    if in_degree[dependent] == 0:
+                        ready.append(dependent)
+                dispatch(ready)
+
+        return completed == len(self.nodes)
+
+    @staticmethod
+    def _check_acyclic(in_degree: Dict[str, int], dependents: Dict[str, List[str]]):
+        remaining = dict(in_degree)
+        ready = [node_id for node_id, degree in remaining.items() if degree == 0]
+        while ready:
+            node_id = ready.pop()
+            del remaining[node_id]
+            for dependent in dependents[node_id]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+        if remaining:
+            raise ValueError(f"Unresolvable agent dependencies: {sorted(remaining)}")
+
+    @staticmethod
+    async def _run_node(node: DAGNode, concurrency_slots: asyncio.Semaphore,
+                        on_success: Optional[Callable[[MockAgent], Awaitable[None]]]) -> bool:
+        async with concurrency_slots:
+            # Checked at dispatch, after the upstream agents ran and possibly cleared this agent's results.
+            if node.agent.is_complete():
+                logger.info("Skipping %s; its results were restored from memory.", node.id)
+                return True
+            logger.info("\n--- Executing Agent: %s ---", node.id)
+            try:
+                result = await asyncio.wait_for(node.agent.execute(), node.timeout)
+                if result == "ERROR_STATE":
+                    logger.error("Flow stopped due to error in %s.", node.id)
+                    return False
+                if on_success is not None:
+                    await on_success(node.agent)
+            except asyncio.TimeoutError:
+                logger.critical("%s timed out after %ss.", node.id, node.timeout)
+                return False
+            except Exception as e:
+                logger.critical("Unhandled exception in %s: %s", node.id, e)
+                return False
+
+        if result == "FLOW_COMPLETE":
+            logger.info("Flow successfully completed.")
+        return True
+
+
+async def run_career_builder_helper(session_id: str = 'default', memory: CareerStateMemory = STATE_MEMORY):
+    """
+    Defines and executes the agent flow, running each agent as soon as its dependencies are done.
+    The session's state is restored from memory, so stages that already completed are skipped.
+    The user-input stages always run again; if an answer changed, the stages built on it are redone.
+    """
 
     # 1. Setup Environment, Plugins, and Tools
     env = setup_adk_environment()
-    adk_state = CareerState()
-
-    # 2. Define the Agent Sequence
-    agent_sequence = [
-        InterestAgent("A1_InterestCapture", adk_state, env),  # 1
-        StreamResearchAgent("A2_StreamResearch", adk_state, env),  # 2
-        LocationAgent("A3_LocationCapture", adk_state, env),  # 3
-        CollegeResearchAgent("A4_CollegeSearch", adk_state, env),  # 4
-        CriteriaAgent("A5_CriteriaSearch", adk_state, env),  # 5
-        ReviewerAgent("A6_Reviewer", adk_state, env),  # 6
-        SummaryAgent("A7_Summary", adk_state, env)  # 7
-    ]
+    adk_state = memory.load(session_id) or CareerState()
+    env['search_batch'] = BatchingSearchTool(results=adk_state.search_results, search_func=env['search_func'])
+    env['gemini_batch'] = GeminiBatchJob()
+
+    # 2. Define the Agent Graph
+    agent_dag = AgentDAG(max_concurrency=env['max_concurrency'])
+    for name, agent_cls, deps in AGENT_SPECS:
+        agent_dag.add_node(_build_agent(name, agent_cls, adk_state, env, session_id), deps)
+
+    async def on_agent_success(agent: MockAgent):
+        # Requests queued by offline agents must be answered before dependent agents run.
+        if agent.batch_requests:
+            await env['gemini_batch'].flush()
+            await asyncio.gather(*agent.batch_requests)
+        memory.store(session_id, adk_state)
 
     logger.info("Starting Career Builder Helper Agentic Flow...")
+    await agent_dag.run(on_success=on_agent_success)
 
-    # Define a Flow object
-    # that manages the execution and state transitions automatically.
+    print(adk_state.final_summary or "\nFlow aborted. Check logs for details.")
 
-    current_agent_index = 0
-    while current_agent_index < len(agent_sequence):
-        agent = agent_sequence[current_agent_index]
-        logger.info(f"\n--- Executing Agent: {agent.name} ---")
 
+async def _pipeline_stage(name: str, agent_cls: type, env: Dict[str, Any],
+                          inbox: asyncio.Queue, outbox: asyncio.Queue):
+    """
+    Runs one agent over every (session id, state) arriving on inbox and forwards it to outbox.
+    Sessions whose agent queued offline requests are held back until the Gemini batch job
+    carrying them answers, while the stage keeps taking new sessions.
+    """
+    awaiting_batch: List[Tuple[Tuple[str, CareerState], List[asyncio.Future]]] = []
+    forwarding: Set[asyncio.Task] = set()
+
+    async def forward_after_batch(sessions: List[Tuple[Tuple[str, CareerState], List[asyncio.Future]]]):
+        # Waits for any job already in flight, then submits everything queued meanwhile in one job.
+        await env['gemini_batch'].flush()
+        for session, batch_requests in sessions:
+            try:
+                await asyncio.gather(*batch_requests)
+            except Exception as e:
+                logger.error("Session %s dropped; its %s batch request failed: %s", session[0], name, e)
+                continue
+            await outbox.put(session)
+
+    while True:
+        session = await inbox.get()
+        if session is None:
+            if awaiting_batch:
+                forwarding.add(asyncio.create_task(forward_after_batch(awaiting_batch)))
+            await asyncio.gather(*forwarding)
+            # End of input: pass the marker on so the next stage shuts down too.
+            await outbox.put(None)
+            return
+
+        session_id, state = session
+        agent = _build_agent(name, agent_cls, state, env, session_id)
         try:
-            result = agent.execute()
-
-            if result == "FLOW_COMPLETE":
-                logger.info("Flow successfully completed.")
-                break
-            elif result == "ERROR_STATE":
-                logger.error(f"Flow stopped due to error in {agent.name}.")
-                break
-            elif result in ("NEXT_STATE", "AWAIT_SELECTION"):
-                # Proceed to the next agent in the sequence
-                current_agent_index += 1
-
+            result = await agent.execute()
         except Exception as e:
-            logger.critical(f"Unhandled exception in {agent.name}: {e}")
-            break
+            logger.critical("Unhandled exception in %s: %s", name, e)
+            continue
 
-    print(adk_state.final_summary or "\nFlow aborted. Check logs for details.")
+        if result == "ERROR_STATE":
+            logger.error("Session %s dropped due to error in %s.", session_id, name)
+            continue
+
+        if not agent.batch_requests:
+            await outbox.put(session)
+            continue
+
+        awaiting_batch.append((session, agent.batch_requests))
+        # Keep collecting while upstream stages have sessions ready, so one job carries them all.
+        if inbox.empty():
+            forwarding.add(asyncio.create_task(forward_after_batch(awaiting_batch)))
+            awaiting_batch = []
+
+
+async def run_career_builder_pipeline(session_count: int) -> List[CareerState]:
+    """
+    Runs the flow for several user sessions as a pipeline: every agent is a long-lived
+    stage, and each session's CareerState flows through the stages in order. While one
+    session waits on a later stage, the earlier stages already work on the next ones.
+    Returns the states of the sessions that completed.
+    """
+    env = setup_adk_environment()
+    env['search_batch'] = BatchingSearchTool(search_func=env['search_func'])
+    env['gemini_batch'] = GeminiBatchJob()
+
+    # queues[i] feeds stage i; the last queue collects completed sessions.
+    queues = [asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in range(len(AGENT_SPECS) + 1)]
+    completed: List[CareerState] = []
+
+    async def feed_sessions():
+        for session_number in range(session_count):
+            await queues[0].put((f"session-{session_number}", CareerState()))
+        await queues[0].put(None)
+
+    async def collect_sessions():
+        while (session := await queues[-1].get()) is not None:
+            completed.append(session[1])
+
+    logger.info("Starting Career Builder Helper pipeline for %d session(s)...", session_count)
+
+    async with asyncio.TaskGroup() as stages:
+        stages.create_task(feed_sessions())
+        for (name, agent_cls, _), inbox, outbox in zip(AGENT_SPECS, queues, queues[1:]):
+            stages.create_task(_pipeline_stage(name, agent_cls, env, inbox, outbox))
+        stages.create_task(collect_sessions())
+
+    logger.info("Pipeline finished: %d of %d session(s) completed.", len(completed), session_count)
+    return completed
 
 
 if __name__ == '__main__':
-    run_career_builder_helper()
\ No newline at end of file
+    asyncio.run(run_career_builder_helper())
@@ -0,0 +1,714 @@
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+import agent
+from agent import (AgentDAG, BatchingSearchTool, CareerState, GeminiBatchJob, MockAgent, SemanticQueryCache,
+                   parse_numbered_list)
+
+
+class FakeAgent(MockAgent):
+    """Agent that sleeps for a while and returns a fixed result, recording when it ran."""
+
+    def __init__(self, name: str, log: list, result: str = "NEXT_STATE", delay: float = 0.0):
+        super().__init__(name, CareerState(), {})
+        self.log = log
+        self.result = result
+        self.delay = delay
+
+    async def execute(self) -> str:
+        self.log.append(('start', self.name))
+        await asyncio.sleep(self.delay)
+        self.log.append(('end', self.name))
+        return self.result
+
+
+class AgentDAGTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_runs_dependents_after_their_dependencies(self):
+        log = []
+        dag = AgentDAG()
+        dag.add_node(FakeAgent('A', log), [])
+        dag.add_node(FakeAgent('B', log, delay=0.01), ['A'])
+        dag.add_node(FakeAgent('C', log), ['A'])
+        dag.add_node(FakeAgent('D', log), ['B', 'C'])
+
+        self.assertTrue(await dag.run())
+
+        self.assertLess(log.index(('end', 'A')), log.index(('start', 'B')))
+        self.assertLess(log.index(('end', 'A')), log.index(('start', 'C')))
+        self.assertLess(log.index(('end', 'B')), log.index(('start', 'D')))
+        self.assertLess(log.index(('end', 'C')), log.index(('start', 'D')))
+        # C does not wait for its slower sibling B.
+        self.assertLess(log.index(('end', 'C')), log.index(('end', 'B')))
+
+    async def test_on_success_runs_before_dependents(self):
+        log = []
+        dag = AgentDAG()
+        dag.add_node(FakeAgent('A', log), [])
+        dag.add_node(FakeAgent('B', log), ['A'])
+
+        async def on_success(finished: MockAgent):
+            log.append(('stored', finished.name))
+
+        self.assertTrue(await dag.run(on_success=on_success))
+        self.assertLess(log.index(('stored', 'A')), log.index(('start', 'B')))
+
+    async def test_respects_max_concurrency(self):
+        running = 0
+        peak = 0
+
+        class CountingAgent(FakeAgent):
+            async def execute(self) -> str:
+                nonlocal running, peak
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+                return "NEXT_STATE"
+
+        dag = AgentDAG(max_concurrency=2)
+        for index in range(5):
+            dag.add_node(CountingAgent(f'A{index}', []), [])
+
+        self.assertTrue(await dag.run())
+        self.assertEqual(peak, 2)
+
+    async def test_failure_stops_dispatch_within_the_same_batch(self):
+        log = []
+        dag = AgentDAG()
+        # A and every B finish in the same asyncio.wait batch; each C depends only on a successful B,
+        # so the outcome must not depend on the order in which the batch is iterated.
+        dag.add_node(FakeAgent('A', log, result="ERROR_STATE"), [])
+        for index in range(8):
+            dag.add_node(FakeAgent(f'B{index}', log), [])
+            dag.add_node(FakeAgent(f'C{index}', log), [f'B{index}'])
+
+        self.assertFalse(await dag.run())
+        self.assertFalse([name for event, name in log if name.startswith('C')])
+
+    async def test_failure_lets_running_agents_finish(self):
+        log = []
+        dag = AgentDAG()
+        dag.add_node(FakeAgent('A', log, result="ERROR_STATE"), [])
+        dag.add_node(FakeAgent('B', log, delay=0.01), [])
+        dag.add_node(FakeAgent('C', log), ['B'])
+
+        self.assertFalse(await dag.run())
+        self.assertIn(('end', 'B'), log)
+        self.assertNotIn(('start', 'C'), log)
+
+    async def test_timeout_fails_the_node(self):
+        log = []
+        dag = AgentDAG()
+        dag.add_node(FakeAgent('A', log, delay=1.0), [], timeout=0.01)
+        dag.add_node(FakeAgent('B', log), ['A'])
+
+        self.assertFalse(await dag.run())
+        self.assertNotIn(('end', 'A'), log)
+        self.assertNotIn(('start', 'B'), log)
+
+    async def test_rejects_cycles(self):
+        dag = AgentDAG()
+        dag.add_node(FakeAgent('A', []), [])
+        dag.add_node(FakeAgent('B', []), ['A', 'C'])
+        dag.add_node(FakeAgent('C', []), ['B'])
+
+        with self.assertRaisesRegex(ValueError, 'Unresolvable'):
+            await dag.run()
+
+    async def test_rejects_unknown_and_duplicate_agents(self):
+        dag = AgentDAG()
+        dag.add_node(FakeAgent('A', []), ['missing'])
+        with self.assertRaisesRegex(ValueError, 'unknown agent'):
+            await dag.run()
+        with self.assertRaisesRegex(ValueError, 'Duplicate'):
+            dag.add_node(FakeAgent('A', []), [])
+
+
+class ParseNumberedListTest(unittest.TestCase):
+
+    def test_keeps_commas_inside_entries(self):
+        self.assertEqual(
+            parse_numbered_list(agent.MOCK_COLLEGES),
+            ["University of California, Berkeley (Bioengineering)",
+             "Stanford University (Sustainable Science and Tech)",
+             "UC Davis (Applied Biology)"],
+        )
+
+    def test_newline_separated_list(self):
+        self.assertEqual(parse_numbered_list("1. UC Berkeley\n2. Stanford\n3. UC Davis\n"),
+                         ["UC Berkeley", "Stanford", "UC Davis"])
+
+    def test_entries_without_space_after_number(self):
+        self.assertEqual(parse_numbered_list("1.UC Berkeley, 2.Stanford"), ["UC Berkeley", "Stanford"])
+
+    def test_decimals_do_not_start_entries(self):
+        self.assertEqual(parse_numbered_list("1. Minimum GPA 3.5, 2. Stanford."), ["Minimum GPA 3.5", "Stanford"])
+
+    def test_unnumbered_input(self):
+        self.assertEqual(parse_numbered_list("UC Berkeley and Stanford"), [])
+        self.assertEqual(parse_numbered_list(""), [])
+
+
+def _unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class SemanticQueryCacheTest(unittest.TestCase):
+
+    def test_hits_only_above_threshold(self):
+        cache = SemanticQueryCache(similarity_threshold=0.92)
+        cache.insert('q', _unit(1, 0), 'result')
+
+        self.assertEqual(cache.lookup(_unit(1, 0)), 'result')
+        self.assertEqual(cache.lookup(_unit(0.95, np.sqrt(1 - 0.95 ** 2))), 'result')
+        self.assertIsNone(cache.lookup(_unit(0.9, np.sqrt(1 - 0.9 ** 2))))
+
+    def test_evicts_least_recently_used(self):
+        cache = SemanticQueryCache(max_entries=2)
+        cache.insert('a', _unit(1, 0, 0), 'A')
+        cache.insert('b', _unit(0, 1, 0), 'B')
+        self.assertEqual(cache.lookup(_unit(1, 0, 0)), 'A')  # 'a' is now the most recently used
+        cache.insert('c', _unit(0, 0, 1), 'C')
+
+        self.assertEqual(list(cache.entries), ['a', 'c'])
+        self.assertIsNone(cache.lookup(_unit(0, 1, 0)))
+
+    def test_expires_entries_after_ttl(self):
+        cache = SemanticQueryCache(ttl_seconds=10.0)
+        with mock.patch('agent.time.monotonic', return_value=100.0):
+            cache.insert('q', _unit(1, 0), 'result')
+        with mock.patch('agent.time.monotonic', return_value=109.0):
+            self.assertEqual(cache.lookup(_unit(1, 0)), 'result')
+        with mock.patch('agent.time.monotonic', return_value=111.0):
+            self.assertIsNone(cache.lookup(_unit(1, 0)))
+        self.assertEqual(len(cache.entries), 0)
+
+    def test_interest_change_clears_cache(self):
+        state = CareerState()
+        state.set_interest('Biology')
+        state.query_cache.insert('q', _unit(1, 0), 'result')
+
+        state.set_interest('Biology')
+        self.assertEqual(len(state.query_cache.entries), 1)
+        state.set_interest('Physics')
+        self.assertEqual(len(state.query_cache.entries), 0)
+
+    def test_update_state_clears_cache_only_on_interest_change(self):
+        state = CareerState(interest_area='Biology')
+        state.query_cache.insert('q', _unit(1, 0), 'result')
+
+        state.update_state(interest_area='Biology', target_stream='Genetics')
+        self.assertEqual(len(state.query_cache.entries), 1)
+        self.assertEqual(state.target_stream, 'Genetics')
+        state.update_state(interest_area='Physics')
+        self.assertEqual(len(state.query_cache.entries), 0)
+        self.assertEqual(state.interest_area, 'Physics')
+
+
+class BatchingSearchToolTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+        self.searched = []
+
+    def fake_search(self, query: str) -> str:
+        self.searched.append(query)
+        if query == 'bad':
+            raise RuntimeError('search failed')
+        return f'result for {query}'
+
+    async def test_searches_identical_queries_once(self):
+        tool = BatchingSearchTool(executor=self.executor, search_func=self.fake_search)
+        results = await asyncio.gather(tool.search('q'), tool.search('q'), tool.search('r'))
+
+        self.assertEqual(results, ['result for q', 'result for q', 'result for r'])
+        self.assertCountEqual(self.searched, ['q', 'r'])
+        self.assertEqual(tool.results[BatchingSearchTool.query_key('q')], 'result for q')
+
+    async def test_reuses_stored_results(self):
+        tool = BatchingSearchTool(results={BatchingSearchTool.query_key('q'): 'stored'}, executor=self.executor,
+                                  search_func=self.fake_search)
+        self.assertEqual(await tool.search('q'), 'stored')
+        self.assertEqual(self.searched, [])
+
+    async def test_error_reaches_only_its_own_waiters(self):
+        tool = BatchingSearchTool(executor=self.executor, search_func=self.fake_search)
+        bad, good = await asyncio.gather(tool.search('bad'), tool.search('q'), return_exceptions=True)
+
+        self.assertIsInstance(bad, RuntimeError)
+        self.assertEqual(good, 'result for q')
+        self.assertNotIn(BatchingSearchTool.query_key('bad'), tool.results)
+
+    async def test_cancelled_waiter_does_not_break_the_batch(self):
+        release = threading.Event()
+
+        def blocking_search(query: str) -> str:
+            release.wait(timeout=5)
+            return f'result for {query}'
+
+        tool = BatchingSearchTool(executor=self.executor, search_func=blocking_search)
+        cancelled = asyncio.create_task(tool.search('q'))
+        waiting = asyncio.create_task(tool.search('q'))
+        await asyncio.sleep(0.01)  # Let the batch go out.
+        cancelled.cancel()
+        release.set()
+
+        self.assertEqual(await waiting, 'result for q')
+        await tool._flush_task  # Resolving the cancelled waiter must not raise.
+        self.assertTrue(cancelled.cancelled())
+
+
+class ThreadLocalSearchTest(unittest.TestCase):
+
+    def test_each_thread_reuses_its_own_client(self):
+        created = []
+
+        def make_client():
+            client = mock.Mock()
+            client.models.generate_content.return_value.text = f'result from client {len(created)}'
+            created.append(client)
+            return client
+
+        def search_twice(results: list):
+            results.append(agent._thread_local_search('q'))
+            results.append(agent._thread_local_search('r'))
+
+        results = []
+        with mock.patch('agent.genai.Client', side_effect=make_client):
+            for _ in range(2):
+                worker = threading.Thread(target=search_twice, args=(results,))
+                worker.start()
+                worker.join()
+
+        self.assertEqual(len(created), 2)
+        self.assertEqual(results, ['result from client 0'] * 2 + ['result from client 1'] * 2)
+        call = created[0].models.generate_content.call_args
+        self.assertEqual(call.kwargs['model'], agent.SEARCH_MODEL)
+        self.assertEqual(call.kwargs['config'].tools[0].google_search, agent.types.GoogleSearch())
+
+
+class FakeGenaiClient:
+    """Stands in for genai.Client in Batch Mode; each request is answered with its own key as text."""
+
+    def __init__(self, job_states: tuple = (), failed_keys: tuple = (), job_seconds: float = 0.0):
+        self.job_states = list(job_states)  # Final state of each job in turn; later jobs succeed
+        self.failed_keys = set(failed_keys)
+        self.job_seconds = job_seconds  # How long each job takes to run
+        self.uploads = []
+        self.upload_released = threading.Event()
+        self.upload_released.set()
+        self.files = SimpleNamespace(upload=self._upload, download=self._download)
+        self.batches = SimpleNamespace(create=self._create)
+
+    def _upload(self, file: str, config):
+        with open(file, encoding='utf-8') as batch_file:
+            keys = [json.loads(line)['key'] for line in batch_file]
+        self.uploads.append((file, keys))
+        self.upload_released.wait(timeout=5)
+        return SimpleNamespace(name=json.dumps(keys))
+
+    def _create(self, model: str, src: str, config):
+        time.sleep(self.job_seconds)
+        state = self.job_states.pop(0) if self.job_states else 'JOB_STATE_SUCCEEDED'
+        return SimpleNamespace(name=f'job-{len(self.uploads)}', state=SimpleNamespace(name=state),
+                               error='job failed', dest=SimpleNamespace(file_name=src))
+
+    def _download(self, file: str) -> bytes:
+        lines = []
+        for key in json.loads(file):
+            if key in self.failed_keys:
+                lines.append(json.dumps({'key': key, 'error': {'code': 500}}))
+            else:
+                lines.append(json.dumps(
+                    {'key': key, 'response': {'candidates': [{'content': {'parts': [{'text': key}]}}]}}))
+        return '\n'.join(lines).encode('utf-8')
+
+
+class GeminiBatchJobTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_requests_queued_during_a_job_go_out_with_the_next(self):
+        client, answers = FakeGenaiClient(), {}
+        client.upload_released.clear()
+        job = GeminiBatchJob()
+        with mock.patch('agent._genai_client', return_value=client):
+            first_answer = job.queue('s0/A6_Reviewer', 'prompt', lambda text: answers.setdefault('s0', text))
+            first = asyncio.create_task(job.flush())
+            await asyncio.sleep(0.01)  # The first job is now uploading.
+            second_answer = job.queue('s1/A6_Reviewer', 'prompt', lambda text: answers.setdefault('s1', text))
+            second = asyncio.create_task(job.flush())
+            client.upload_released.set()
+            await asyncio.gather(first, second)
+
+        self.assertEqual([keys for _, keys in client.uploads], [['s0/A6_Reviewer'], ['s1/A6_Reviewer']])
+        self.assertEqual(answers, {'s0': 's0/A6_Reviewer', 's1': 's1/A6_Reviewer'})
+        self.assertEqual((first_answer.result(), second_answer.result()), ('s0/A6_Reviewer', 's1/A6_Reviewer'))
+        self.assertFalse(any(os.path.exists(path) for path, _ in client.uploads))
+
+    async def test_failed_request_only_fails_its_own_future(self):
+        answers = {}
+        job = GeminiBatchJob()
+        futures = {key: job.queue(key, 'prompt', lambda text, key=key: answers.setdefault(key, text))
+                   for key in ('a', 'b', 'c', 'd')}
+        with mock.patch('agent._genai_client', return_value=FakeGenaiClient(failed_keys=('b', 'c'))), \
+                self.assertLogs('CareerBuilderHelper', 'ERROR') as logs:
+            await job.flush()
+
+        self.assertEqual(answers, {'a': 'a', 'd': 'd'})
+        self.assertEqual(futures['d'].result(), 'd')
+        self.assertIsInstance(futures['b'].exception(), RuntimeError)
+        self.assertIsInstance(futures['c'].exception(), RuntimeError)
+        # Both failures are reported in one record.
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn("'b'", logs.output[0])
+        self.assertIn("'c'", logs.output[0])
+
+    async def test_failed_job_fails_every_future(self):
+        callback = mock.Mock()
+        job = GeminiBatchJob()
+        futures = [job.queue(key, 'prompt', callback) for key in ('a', 'b')]
+        with mock.patch('agent._genai_client', return_value=FakeGenaiClient(job_states=('JOB_STATE_FAILED',))), \
+                self.assertLogs('CareerBuilderHelper', 'ERROR'):
+            await job.flush()
+
+        callback.assert_not_called()
+        self.assertTrue(all(isinstance(future.exception(), RuntimeError) for future in futures))
+        self.assertFalse(job.has_pending)
+
+    async def test_rejects_duplicate_keys(self):
+        job = GeminiBatchJob()
+        job.queue('s0/A6_Reviewer', 'prompt', print)
+        with self.assertRaisesRegex(ValueError, 'already queued'):
+            job.queue('s0/A6_Reviewer', 'prompt', print)
+
+
+
+def _offline_reviewer_env():
+    env = _SETUP_ADK_ENVIRONMENT()
+    env['execution_modes'] = {'A6_Reviewer': agent.OFFLINE}
+    return env
+
+
+_SETUP_ADK_ENVIRONMENT = agent.setup_adk_environment
+
+
+class PipelineTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_completes_every_session(self):
+        completed = await agent.run_career_builder_pipeline(3)
+
+        self.assertEqual(len(completed), 3)
+        self.assertTrue(all(state.final_summary for state in completed))
+
+    async def test_offline_reviews_share_batch_jobs(self):
+        client = FakeGenaiClient(job_seconds=0.05)
+        with mock.patch('agent.setup_adk_environment', _offline_reviewer_env), \
+                mock.patch('agent._genai_client', return_value=client):
+            completed = await agent.run_career_builder_pipeline(6)
+
+        self.assertEqual(sorted(state.reviewer_notes for state in completed),
+                         [f'session-{index}/A6_Reviewer' for index in range(6)])
+        self.assertLess(len(client.uploads), 6)
+        self.assertEqual(sorted(key for _, keys in client.uploads for key in keys),
+                         [f'session-{index}/A6_Reviewer' for index in range(6)])
+
+    async def test_failed_batch_job_drops_its_sessions(self):
+        client = FakeGenaiClient(job_states=('JOB_STATE_SUCCEEDED', 'JOB_STATE_FAILED'), job_seconds=0.05)
+        with mock.patch('agent.setup_adk_environment', _offline_reviewer_env), \
+                mock.patch('agent._genai_client', return_value=client), \
+                self.assertLogs('CareerBuilderHelper', 'ERROR'):
+            completed = await agent.run_career_builder_pipeline(6)
+
+        # Sessions of the second job are dropped; those of every other job reach the summary stage.
+        failed_keys = client.uploads[1][1]
+        self.assertEqual(sorted(state.reviewer_notes for state in completed),
+                         sorted(key for _, keys in client.uploads for key in keys if key not in failed_keys))
+        self.assertEqual(len(completed), 6 - len(failed_keys))
+        self.assertTrue(all('None' not in state.final_summary for state in completed))
+
+
+
+async def _run_flow(session_id: str, memory: agent.CareerStateMemory, searched: list) -> CareerState:
+    """Runs the whole flow on the mock search backend, recording every query it searches."""
+    def recording_search(query: str) -> str:
+        searched.append(query)
+        return agent.mock_search(query)
+
+    def recording_env():
+        env = _SETUP_ADK_ENVIRONMENT()
+        env['search_func'] = recording_search
+        return env
+
+    with mock.patch('agent.setup_adk_environment', recording_env), contextlib.redirect_stdout(io.StringIO()):
+        await agent.run_career_builder_helper(session_id, memory)
+    return memory.load(session_id)
+
+
+class FlowSearchTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_agents_search_through_the_batch(self):
+        searched = []
+        state = await _run_flow('search-session', agent.CareerStateMemory(), searched)
+
+        self.assertEqual(state.suggested_streams, agent.MOCK_STREAMS)
+        self.assertEqual(state.college_results, agent.MOCK_COLLEGES)
+        self.assertEqual(state.criteria_details, " ".join(agent.MOCK_CRITERIA.values()))
+        self.assertTrue(any('streams' in query for query in searched))
+        self.assertTrue(any('colleges in Berkeley, California' in query for query in searched))
+        for college in agent.MOCK_CRITERIA:
+            self.assertIn(f"Admission criteria and process for {college}", searched)
+        self.assertEqual(len(searched), len(set(searched)))
+
+
+def _stale_state(**inputs) -> CareerState:
+    values = dict(interest_area=agent.MOCK_INTEREST, suggested_streams='stale streams',
+                  user_location=dict(agent.MOCK_LOCATION), target_stream=agent.MOCK_SELECTION,
+                  college_results='stale colleges', criteria_details='stale criteria',
+                  reviewer_notes='stale review', final_summary='stale summary')
+    values.update(inputs)
+    return CareerState(**values)
+
+
+class ResumeTest(unittest.IsolatedAsyncioTestCase):
+
+    async def test_rerun_skips_completed_stages(self):
+        memory = agent.CareerStateMemory()
+        first = await _run_flow('resume', memory, [])
+
+        searched = []
+        with self.assertLogs('CareerBuilderHelper', 'INFO') as logs:
+            second = await _run_flow('resume', memory, searched)
+
+        self.assertEqual(searched, [])
+        self.assertEqual(second.final_summary, first.final_summary)
+        skipped = {name for name, _, _ in agent.AGENT_SPECS if any(f"Skipping {name};" in line for line in logs.output)}
+        # The user-input stages ask again; everything built on unchanged answers is reused.
+        self.assertEqual(skipped, {'A2_StreamResearch', 'A4_CollegeSearch', 'A5_CriteriaSearch', 'A6_Reviewer',
+                                   'A7_Summary'})
+
+    async def test_changed_interest_redoes_every_stage(self):
+        memory = agent.CareerStateMemory()
+        memory.store('resume', _stale_state(interest_area='Astronomy'))
+
+        searched = []
+        state = await _run_flow('resume', memory, searched)
+
+        self.assertEqual(state.interest_area, agent.MOCK_INTEREST)
+        self.assertEqual(state.suggested_streams, agent.MOCK_STREAMS)
+        self.assertEqual(state.college_results, agent.MOCK_COLLEGES)
+        self.assertNotIn('stale', state.final_summary)
+        self.assertTrue(any('streams' in query for query in searched))
+
+    async def test_changed_location_keeps_earlier_stages(self):
+        memory = agent.CareerStateMemory()
+        memory.store('resume', _stale_state(user_location={'state': 'Texas', 'city': 'Austin'}))
+
+        searched = []
+        state = await _run_flow('resume', memory, searched)
+
+        self.assertEqual(state.suggested_streams, 'stale streams')
+        self.assertFalse(any('streams' in query for query in searched))
+        self.assertEqual(state.user_location, dict(agent.MOCK_LOCATION))
+        self.assertEqual(state.college_results, agent.MOCK_COLLEGES)
+        self.assertNotIn('stale review', state.final_summary)
+        self.assertIn('Berkeley, California', state.final_summary)
+
+    def test_unchanged_answer_keeps_later_results(self):
+        state = _stale_state()
+        state.set_selection(dict(agent.MOCK_LOCATION), agent.MOCK_SELECTION)
+        self.assertEqual(state.college_results, 'stale colleges')
+
+        state.set_selection(dict(agent.MOCK_LOCATION), 'Environmental Science and Policy')
+        self.assertEqual(state.suggested_streams, 'stale streams')
+        self.assertIsNone(state.college_results)
+        self.assertIsNone(state.final_summary)
+
+
+
+class LoggingTest(unittest.TestCase):
+
+    def make_record(self, msg: str, args, exc_info=None) -> logging.LogRecord:
+        return logging.getLogger('ADK.test').makeRecord('ADK.test', logging.INFO, __file__, 1, msg, args, exc_info)
+
+    def test_json_formatter_emits_one_json_object(self):
+        entry = json.loads(agent._JsonFormatter().format(self.make_record("Found %d colleges in %s", (3, 'Berkeley'))))
+
+        self.assertEqual(entry['lvl'], 'INFO')
+        self.assertEqual(entry['logger'], 'ADK.test')
+        # The message template and its arguments are kept apart, not rendered into one string.
+        self.assertEqual(entry['msg'], "Found %d colleges in %s")
+        self.assertEqual(entry['args'], [3, 'Berkeley'])
+        self.assertNotIn('exc', entry)
+
+    def test_json_formatter_includes_exceptions_and_unserializable_args(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = self.make_record("state_updated %s", ({'location': {'city'}},), sys.exc_info())
+        entry = json.loads(agent._JsonFormatter().format(record))
+
+        self.assertEqual(entry['args'], {'location': "{'city'}"})
+        self.assertIn('ValueError: boom', entry['exc'])
+
+    def test_queue_handler_leaves_formatting_to_the_listener(self):
+        record = self.make_record("Found %d colleges", (3,))
+        prepared = agent._DeferredQueueHandler(queue.SimpleQueue()).prepare(record)
+
+        self.assertIs(prepared, record)
+        self.assertEqual((prepared.msg, prepared.args), ("Found %d colleges", (3,)))
+
+    def test_configure_logging_leaves_configured_hosts_alone(self):
+        handler = logging.NullHandler()
+        root_logger = logging.getLogger()
+        with mock.patch.object(root_logger, 'handlers', [handler]):
+            self.assertIsNone(agent._configure_logging())
+            self.assertEqual(root_logger.handlers, [handler])
+
+    def test_state_updates_are_readable_with_plain_formatters(self):
+        with self.assertLogs('CareerBuilderHelper', 'INFO') as logs:
+            CareerState().set_colleges('1. UC Davis')
+
+        self.assertIn("state_updated {'college_results': '1. UC Davis'}", logs.output[-1])
+
+
+
+class CriteriaAgentTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=8)
+        self.addCleanup(self.executor.shutdown)
+
+    def criteria_agent(self, colleges: str, search_func) -> agent.CriteriaAgent:
+        state = CareerState(target_stream='Bioengineering', college_results=colleges)
+        tools = {'cache_enabled': False,
+                 'search_batch': BatchingSearchTool(executor=self.executor, search_func=search_func)}
+        return agent.CriteriaAgent('A5_CriteriaSearch', state, tools)
+
+    async def test_searches_every_college_concurrently(self):
+        # Each search waits until all three are in flight, so a serial fan-out would break the barrier.
+        all_in_flight = threading.Barrier(3, timeout=5)
+
+        def search(query: str) -> str:
+            all_in_flight.wait()
+            return query.rsplit(' for ', 1)[1] + ': criteria'
+
+        criteria_agent = self.criteria_agent(agent.MOCK_COLLEGES, search)
+        self.assertEqual(await criteria_agent.execute(), "NEXT_STATE")
+
+        self.assertEqual(criteria_agent.state.criteria_details,
+                         " ".join(f"{college}: criteria" for college in agent.MOCK_CRITERIA))
+
+    async def test_caps_searches_in_flight(self):
+        lock = threading.Lock()
+        in_flight = peak = 0
+
+        def search(query: str) -> str:
+            nonlocal in_flight, peak
+            with lock:
+                in_flight += 1
+                peak = max(peak, in_flight)
+            time.sleep(0.02)
+            with lock:
+                in_flight -= 1
+            return 'criteria'
+
+        colleges = ", ".join(f"{index}. College {index}" for index in range(1, 7))
+        with mock.patch('agent.MAX_CONCURRENT_SEARCHES', 2):
+            self.assertEqual(await self.criteria_agent(colleges, search).execute(), "NEXT_STATE")
+        self.assertEqual(peak, 2)
+
+    async def test_searches_unnumbered_results_as_one_query(self):
+        searched = []
+
+        def search(query: str) -> str:
+            searched.append(query)
+            return 'criteria'
+
+        criteria_agent = self.criteria_agent("UC Berkeley and Stanford", search)
+        self.assertEqual(await criteria_agent.execute(), "NEXT_STATE")
+
+        self.assertEqual(searched, ["Admission criteria and process for UC Berkeley and Stanford"])
+        self.assertEqual(criteria_agent.state.criteria_details, 'criteria')
+
+    async def test_fails_without_college_results(self):
+        self.assertEqual(await self.criteria_agent(None, print).execute(), "ERROR_STATE")
+
+
+
+class FirstSuccessTest(unittest.IsolatedAsyncioTestCase):
+
+    def college_agent(self, outcomes: dict) -> agent.CollegeResearchAgent:
+        """Agent whose search for each query sleeps, then returns or raises the given outcome."""
+        college_agent = agent.CollegeResearchAgent('A4_CollegeSearch', CareerState(), {})
+        self.cancelled = []
+
+        async def search_colleges(query: str) -> str:
+            delay, outcome = outcomes[query]
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.cancelled.append(query)
+                raise
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        college_agent._search_colleges = search_colleges
+        return college_agent
+
+    async def test_returns_first_usable_result_and_cancels_the_rest(self):
+        college_agent = self.college_agent({'slow': (1.0, agent.MOCK_COLLEGES), 'fast': (0.0, "1. A, 2. B, 3. C")})
+
+        self.assertEqual(await college_agent._first_success(['slow', 'fast']), "1. A, 2. B, 3. C")
+        await asyncio.sleep(0)  # Let the cancellation reach the losing search.
+        self.assertEqual(self.cancelled, ['slow'])
+
+    async def test_skips_failed_and_short_results(self):
+        college_agent = self.college_agent({
+            'error': (0.0, RuntimeError('search failed')),
+            'short': (0.01, "1. A, 2. B"),
+            'good': (0.02, agent.MOCK_COLLEGES),
+        })
+
+        with self.assertLogs('ADK.A4_CollegeSearch', 'WARNING'):
+            self.assertEqual(await college_agent._first_success(['error', 'short', 'good']), agent.MOCK_COLLEGES)
+
+    async def test_returns_none_when_no_result_is_usable(self):
+        college_agent = self.college_agent({'short': (0.0, "1. A"), 'error': (0.0, RuntimeError('search failed'))})
+
+        with self.assertLogs('ADK.A4_CollegeSearch', 'WARNING'):
+            self.assertIsNone(await college_agent._first_success(['short', 'error']))
+
+    async def test_gives_up_after_the_timeout(self):
+        college_agent = self.college_agent({'slow': (1.0, agent.MOCK_COLLEGES)})
+
+        with mock.patch('agent.COLLEGE_RESEARCH_TIMEOUT', 0.01), self.assertLogs('ADK.A4_CollegeSearch', 'WARNING'):
+            self.assertIsNone(await college_agent._first_success(['slow']))
+        await asyncio.sleep(0)
+        self.assertEqual(self.cancelled, ['slow'])
+
+    async def test_execute_fails_without_a_usable_result(self):
+        college_agent = self.college_agent({})
+        college_agent.state = _stale_state()
+        with mock.patch.object(college_agent, '_first_success', mock.AsyncMock(return_value=None)):
+            self.assertEqual(await college_agent.execute(), "ERROR_STATE")
+
+
+if __name__ == '__main__':
+    unittest.main()